@@ -15,12 +15,15 @@ Author: Sam Johnston
 """
 
 import os
+import numpy as np
 import pandas as pd
 import re
 import sys
-from shapely.geometry import Point, Polygon
+from numba import njit, prange
+from shapely.geometry import Polygon
 import matplotlib.pyplot as plt
 from matplotlib.patches import Polygon as PolygonPatch
+from matplotlib.collections import PatchCollection
 from matplotlib.colors import Normalize
 from matplotlib.cm import ScalarMappable
 import matplotlib.patheffects as path_effects
@@ -34,19 +37,33 @@ print(f"📁 Working directory set to: {os.getcwd()}")
 
 # ========== Data Loading Functions ==========
 
-def load_data(breadcrumbs_path='data/caldera_breadcrumbs.csv', boundaries_path='data/CalderaCoordinates.xlsx'):
+BREADCRUMB_DTYPES = {
+    'match_id': 'int32',
+    'player_id': 'int32',
+    'time_step': 'float32',
+    'pos_x': 'float32',
+    'pos_y': 'float32',
+    'pos_z': 'float32',
+    'life': 'int8',
+}
+
+def load_data(breadcrumbs_path='data/caldera_breadcrumbs.parquet', boundaries_path='data/CalderaCoordinates.xlsx'):
     """
     Load breadcrumb and POI data from local files.
 
     Parameters:
-        breadcrumbs_path (str): Path to CSV with breadcrumb data.
+        breadcrumbs_path (str): Path to Parquet file with breadcrumb data.
         boundaries_path (str): Path to Excel file with POI polygons.
 
     Returns:
         tuple: (breadcrumbs_df, boundaries_df)
     """
     try:
-        breadcrumbs_df = pd.read_csv(breadcrumbs_path)
+        breadcrumbs_df = pd.read_parquet(breadcrumbs_path, columns=list(BREADCRUMB_DTYPES))
+        # Files written with a wider schema are narrowed; matching columns are left as-is
+        for col, dtype in BREADCRUMB_DTYPES.items():
+            if breadcrumbs_df[col].dtype != dtype:
+                breadcrumbs_df[col] = breadcrumbs_df[col].astype(dtype)
         boundaries_df = pd.read_excel(boundaries_path)
         print("✅ Loaded breadcrumbs and POI boundaries.")
         return breadcrumbs_df, boundaries_df
@@ -60,6 +77,8 @@ def load_data(breadcrumbs_path='data/caldera_breadcrumbs.csv', boundaries_path='
 
 # ========== Polygon Creation ==========
 
+_COORD_RE = re.compile(r'-?\d+\.?\d*')
+
 def parse_poi_polygons(boundaries_df):
     """
     Convert POI coordinate rows from Excel into shapely polygons.
@@ -72,21 +91,23 @@ def parse_poi_polygons(boundaries_df):
     """
     def parse_coords_from_row(row):
         coords = []
-        for i in range(1, 10):
-            coord_val = row.get(f'Coordinate {i}')
+        for coord_val in row:
             if pd.notna(coord_val):
-                numbers = re.findall(r'-?\d+\.?\d*', str(coord_val))
+                numbers = _COORD_RE.findall(str(coord_val))
                 if len(numbers) == 2:
                     coords.append((float(numbers[0]), float(numbers[1])))
         return coords
 
+    coord_cols = [f'Coordinate {i}' for i in range(1, 10)]
+    coord_rows = boundaries_df.reindex(columns=coord_cols).to_numpy()
+
     poi_polygons = []
-    for _, row in boundaries_df.iterrows():
+    for name, letter, row in zip(boundaries_df['Name'], boundaries_df['Shape'], coord_rows):
         coords = parse_coords_from_row(row)
         if coords:
             poi_polygons.append({
-                "name": row['Name'],
-                "letter": row['Shape'],
+                "name": name,
+                "letter": letter,
                 "polygon": Polygon(coords)
             })
     return poi_polygons
@@ -94,23 +115,84 @@ def parse_poi_polygons(boundaries_df):
 
 # ========== Point Classification ==========
 
-def classify_point(x, y, poi_polygons):
+def pack_poi_polygons(poi_polygons):
+    """
+    Flatten POI polygon exteriors into contiguous vertex arrays.
+
+    Parameters:
+        poi_polygons (list): List of polygon definitions.
+
+    Returns:
+        tuple: (verts_x, verts_y, offsets, bboxes) where polygon k spans
+               verts[offsets[k]:offsets[k + 1]] and bboxes[k] is its
+               (minx, miny, maxx, maxy).
+    """
+    rings = [np.asarray(p['polygon'].exterior.coords)[:-1] for p in poi_polygons]
+    offsets = np.zeros(len(rings) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(r) for r in rings])
+    verts = np.concatenate(rings) if rings else np.empty((0, 2))
+    bboxes = np.array([p['polygon'].bounds for p in poi_polygons], dtype=np.float64).reshape(-1, 4)
+    return verts[:, 0].copy(), verts[:, 1].copy(), offsets, bboxes
+
+
+@njit(parallel=True, cache=True)
+def classify_batch(px, py, verts_x, verts_y, offsets, bboxes, out):
+    """
+    Ray-cast every point against every polygon, storing the index of the
+    first polygon that contains it (or the polygon count if none do).
+    Polygons whose bounding box excludes the point are skipped outright, and
+    points on a polygon's boundary do not count as inside it, matching
+    shapely's Polygon.contains.
+    """
+    n_polys = len(offsets) - 1
+    for i in prange(len(px)):
+        x = px[i]
+        y = py[i]
+        out[i] = n_polys
+        for k in range(n_polys):
+            if x < bboxes[k, 0] or y < bboxes[k, 1] or x > bboxes[k, 2] or y > bboxes[k, 3]:
+                continue
+            start = offsets[k]
+            end = offsets[k + 1]
+            inside = False
+            j = end - 1
+            for v in range(start, end):
+                xi = verts_x[v]
+                yi = verts_y[v]
+                xj = verts_x[j]
+                yj = verts_y[j]
+                if ((xj - xi) * (y - yi) == (yj - yi) * (x - xi)
+                        and min(xi, xj) <= x <= max(xi, xj) and min(yi, yj) <= y <= max(yi, yj)):
+                    inside = False
+                    break
+                if (yi > y) != (yj > y) and x < (xj - xi) * (y - yi) / (yj - yi) + xi:
+                    inside = not inside
+                j = v
+            if inside:
+                out[i] = k
+                break
+
+
+def classify_points(x, y, poi_polygons):
     """
-    Determine which POI (if any) a point falls within.
+    Determine which POI (if any) each point falls within, in one batch.
 
     Parameters:
-        x (float): X coordinate.
-        y (float): Y coordinate.
+        x (array-like): X coordinates.
+        y (array-like): Y coordinates.
         poi_polygons (list): List of polygon definitions.
 
     Returns:
-        str: Name of the POI or 'Other'.
+        ndarray: Name of the POI or 'Other' for each point.
     """
-    point = Point(x, y)
-    for poi in poi_polygons:
-        if poi['polygon'].contains(point):
-            return poi['name']
-    return 'Other'
+    poi_names = np.array([p['name'] for p in poi_polygons] + ['Other'], dtype=object)
+    verts_x, verts_y, offsets, bboxes = pack_poi_polygons(poi_polygons)
+
+    px = np.ascontiguousarray(x)
+    py = np.ascontiguousarray(y)
+    match = np.empty(len(px), dtype=np.int64)
+    classify_batch(px, py, verts_x, verts_y, offsets, bboxes, match)
+    return poi_names[match]
 
 
 # ========== Summary Statistics ==========
@@ -127,18 +209,41 @@ def create_landing_and_survival_stats(breadcrumbs_df, poi_polygons):
         tuple: (analysis_df with landing + survival, death_df with death points)
     """
     unique_id = ['match_id', 'player_id']
-    active_df = breadcrumbs_df[breadcrumbs_df['life'] >= 0].copy()
-
-    active_df['start_time'] = active_df.groupby(unique_id)['time_step'].transform('min')
-    landing_window_df = active_df[active_df['time_step'] <= (active_df['start_time'] + 45)]
-    landing_df = landing_window_df.loc[landing_window_df.groupby(unique_id)['pos_z'].idxmin()]
-
-    death_df = breadcrumbs_df.loc[breadcrumbs_df.groupby(unique_id)['life'].idxmax()]
-    survival_df = active_df.groupby(unique_id)['time_step'].max().reset_index(name='survival_time')
-
-    analysis_df = pd.merge(landing_df[unique_id + ['pos_x', 'pos_y']], survival_df, on=unique_id)
-    analysis_df['landing_poi'] = analysis_df.apply(lambda row: classify_point(row['pos_x'], row['pos_y'], poi_polygons), axis=1)
-    death_df['death_poi'] = death_df.apply(lambda row: classify_point(row['pos_x'], row['pos_y'], poi_polygons), axis=1)
+    # Hash the composite key once; every later grouping reuses the int code.
+    # Codes stay local so the caller's frame is not given an extra column.
+    grouped = breadcrumbs_df.groupby(unique_id, observed=True)
+    gid = grouped.ngroup().to_numpy()
+    # Mask the alive rows instead of copying them into a second full frame
+    alive = breadcrumbs_df['life'].to_numpy() >= 0
+    alive_times = breadcrumbs_df['time_step'][alive]
+
+    # One grouped pass gives both the spawn time and the survival time
+    times_df = (alive_times.groupby(gid[alive], sort=False, observed=True)
+                .agg(start_time='min', survival_time='max'))
+    times_df.index.name = '_gid'
+
+    # gid is a dense 0..n-1 code, so a per-player array lookup stands in for a broadcast
+    time_step = breadcrumbs_df['time_step'].to_numpy()
+    window_end = np.full(grouped.ngroups, -np.inf, dtype=time_step.dtype)
+    window_end[times_df.index.to_numpy()] = times_df['start_time'].to_numpy() + 45
+    in_window = alive & (time_step <= window_end[gid])
+    landing_window_df = breadcrumbs_df.loc[in_window, unique_id + ['pos_x', 'pos_y', 'pos_z']]
+    landing_window_df.insert(0, '_gid', gid[in_window])
+    # Stable sorts keep the first row on ties, matching idxmin/idxmax
+    landing_df = (landing_window_df.sort_values(['_gid', 'pos_z'], kind='stable')
+                  .drop_duplicates('_gid', keep='first'))
+
+    # Same death rule (highest life, first row on ties) without a sortable _gid column
+    death_order = np.lexsort((-breadcrumbs_df['life'].to_numpy(dtype=np.float64), gid))
+    first_in_group = np.diff(gid[death_order], prepend=-1) != 0
+    death_df = breadcrumbs_df.iloc[death_order[first_in_group]].copy()
+    # One row per player, so widen before the POI averages reach the exported summaries
+    survival_df = times_df['survival_time'].astype('float64').reset_index()
+
+    analysis_df = (pd.merge(landing_df[['_gid'] + unique_id + ['pos_x', 'pos_y']], survival_df, on='_gid')
+                   .drop(columns='_gid'))
+    analysis_df['landing_poi'] = classify_points(analysis_df['pos_x'], analysis_df['pos_y'], poi_polygons)
+    death_df['death_poi'] = classify_points(death_df['pos_x'], death_df['pos_y'], poi_polygons)
 
     return analysis_df, death_df
 
@@ -183,7 +288,49 @@ def summarize_death_data(death_df, poi_polygons):
     return df
 
 
-def create_heatmap(map_df, column, title, cmap_name, scatter_df, poi_polygons):
+# ========== Visualization ==========
+
+MAP_EXTENT = (-70000, 70000, -70000, 70000)
+DENSITY_BINS = 500
+HIGH_DPI = False  # Set True for publication-quality 300 dpi output
+SAVE_DPI = 300 if HIGH_DPI else 150
+
+
+def compute_density(positions_df):
+    """
+    Bin player positions into a 2D histogram covering the map extent.
+
+    Parameters:
+        positions_df (DataFrame): Player positions with pos_x and pos_y.
+
+    Returns:
+        ndarray: DENSITY_BINS x DENSITY_BINS counts, indexed [x, y].
+    """
+    density, _, _ = np.histogram2d(positions_df['pos_x'], positions_df['pos_y'], bins=DENSITY_BINS,
+                                   range=[MAP_EXTENT[:2], MAP_EXTENT[2:]])
+    return density
+
+
+def prepare_poi_geometry(poi_polygons):
+    """
+    Build the POI outlines and label positions shared by every heatmap.
+
+    Parameters:
+        poi_polygons (list): List of POI polygons.
+
+    Returns:
+        dict: 'names', 'letters' (length-K arrays), 'patches' (list of matplotlib
+              polygons) and 'centroids' (K x 2 array).
+    """
+    return {
+        "names": np.array([p['name'] for p in poi_polygons], dtype=object),
+        "letters": np.array([p['letter'] for p in poi_polygons], dtype=object),
+        "patches": [PolygonPatch(np.asarray(p['polygon'].exterior.coords)) for p in poi_polygons],
+        "centroids": np.array([(p['polygon'].centroid.x, p['polygon'].centroid.y) for p in poi_polygons])
+    }
+
+
+def create_heatmap(map_df, column, title, cmap_name, density, poi_geometry):
     """
     Generate and save a heatmap visualization for the given POI metric.
 
@@ -192,27 +339,29 @@ def create_heatmap(map_df, column, title, cmap_name, scatter_df, poi_polygons):
         column (str): Column name to color by (e.g., 'player_count').
         title (str): Plot title and output filename label.
         cmap_name (str): Matplotlib colormap to use.
-        scatter_df (DataFrame): Raw player position data.
-        poi_polygons (list): List of POI polygons.
+        density (ndarray): Binned player positions from compute_density.
+        poi_geometry (dict): Shared POI names, outlines and centroids from prepare_poi_geometry.
     """
     fig, ax = plt.subplots(figsize=(12, 12))
     ax.set_facecolor('black')
-    ax.scatter(scatter_df['pos_x'], scatter_df['pos_y'], s=1, alpha=0.05, color='gray')
+    ax.imshow(np.log1p(density.T), origin='lower', extent=MAP_EXTENT, aspect='auto', cmap='gray', alpha=0.4)
 
     values = map_df[column]
     norm = Normalize(vmin=values.min(), vmax=values.max())
     cmap = plt.get_cmap(cmap_name)
 
-    for poi in poi_polygons:
-        name = poi['name']
-        if name in values.index:
-            color = cmap(norm(values[name]))
-            patch = PolygonPatch(poi['polygon'].exterior.coords, facecolor=color, edgecolor='white', linewidth=0.5, alpha=0.8)
-            ax.add_patch(patch)
+    names = poi_geometry['names']
+    drawn = np.flatnonzero(np.isin(names, values.index))
+    colors = cmap(norm(values.reindex(names[drawn]).to_numpy()))
+
+    collection = PatchCollection([poi_geometry['patches'][i] for i in drawn], edgecolor='white', linewidth=0.5, alpha=0.8)
+    collection.set_rasterized(True)
+    collection.set_facecolors(colors)
+    ax.add_collection(collection)
 
-            centroid = poi['polygon'].centroid
-            ax.text(centroid.x, centroid.y, poi['letter'], color='white', fontsize=14, ha='center', va='center',
-                    path_effects=[path_effects.Stroke(linewidth=2, foreground='black'), path_effects.Normal()])
+    for (x, y), letter in zip(poi_geometry['centroids'][drawn], poi_geometry['letters'][drawn]):
+        ax.text(x, y, letter, color='white', fontsize=14, ha='center', va='center',
+                path_effects=[path_effects.Stroke(linewidth=2, foreground='black'), path_effects.Normal()])
 
     sm = ScalarMappable(norm=norm, cmap=cmap)
     sm.set_array([])
@@ -221,13 +370,14 @@ def create_heatmap(map_df, column, title, cmap_name, scatter_df, poi_polygons):
     ax.set_title(title)
     ax.set_xlabel('X Coordinate')
     ax.set_ylabel('Y Coordinate')
-    ax.set_xlim(-70000, 70000)
-    ax.set_ylim(-70000, 70000)
+    ax.set_xlim(MAP_EXTENT[:2])
+    ax.set_ylim(MAP_EXTENT[2:])
     fig.tight_layout()
 
     output_path = f'outputs/heatmap_{title.replace(" ", "_")}.png'
-    plt.savefig(output_path, dpi=300, bbox_inches='tight', facecolor='black')
+    fig.savefig(output_path, dpi=SAVE_DPI, bbox_inches='tight', facecolor='black')
     plt.show()
+    plt.close(fig)
 
 
 def main():
@@ -257,9 +407,12 @@ def main():
 
     # Step 5: Visualizations
     print("\n--- Generating Heatmaps ---")
-    create_heatmap(landing_summary.set_index('Name'), 'player_count', 'Player Count by Landing POI', 'viridis', analysis_df, poi_polygons)
-    create_heatmap(landing_summary.set_index('Name'), 'survival_score', 'Landing Survival Score (0–100)', 'magma', analysis_df, poi_polygons)
-    create_heatmap(death_summary.set_index('Name'), 'death_count', 'Player Death Count by POI', 'hot', death_df, poi_polygons)
+    poi_geometry = prepare_poi_geometry(poi_polygons)
+    landing_density = compute_density(analysis_df)
+    death_density = compute_density(death_df)
+    create_heatmap(landing_summary.set_index('Name'), 'player_count', 'Player Count by Landing POI', 'viridis', landing_density, poi_geometry)
+    create_heatmap(landing_summary.set_index('Name'), 'survival_score', 'Landing Survival Score (0–100)', 'magma', landing_density, poi_geometry)
+    create_heatmap(death_summary.set_index('Name'), 'death_count', 'Player Death Count by POI', 'hot', death_density, poi_geometry)
 
     # === Save summary tables ===
     landing_summary.to_csv("outputs/landing_summary.csv", index=False)
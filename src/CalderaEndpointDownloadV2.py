@@ -2,7 +2,7 @@
 CalderaEndpointDownload.py
 
 Extracts breadcrumb data for all players from the Caldera .usda file.
-Outputs a CSV of player position and life values over time.
+Outputs a Parquet file of player position and life values over time.
 
 Author: Sam Johnston
 """
@@ -20,15 +20,30 @@ os.chdir(PROJECT_ROOT)
 print(f"📁 Current working directory set to: {os.getcwd()}")
 
 
-import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 import re
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pxr import Usd
 
 # === File Paths ===
 USD_FILE_PATH = r"changethistoyourusdafile"
-OUTPUT_CSV = "data/caldera_breadcrumbs.csv"
+OUTPUT_PARQUET = "data/caldera_breadcrumbs.parquet"
 CHUNK_SIZE = 200
+WRITE_BUFFER_SIZE = 1 << 20
+MAX_WORKERS = os.cpu_count()
+
+BREADCRUMB_SCHEMA = pa.schema([
+    ('match_id', pa.int32()),
+    ('player_id', pa.int32()),
+    ('time_step', pa.float32()),
+    ('pos_x', pa.float32()),
+    ('pos_y', pa.float32()),
+    ('pos_z', pa.float32()),
+    ('life', pa.int8()),
+])
 
 # === Core Functions ===
 
@@ -59,7 +74,7 @@ def find_player_paths(stage):
 def extract_player_data(stage, path):
     try:
         prim = stage.GetPrimAtPath(path)
-        if not prim: return []
+        if not prim: return None
 
         match = re.search(r'match_(\d+)', path)
         player = re.search(r'player_(\d+)', path)
@@ -70,29 +85,37 @@ def extract_player_data(stage, path):
         life_attr = prim.GetAttribute('primvars:life')
 
         if not pos_attr or not life_attr:
-            return []
-
-        return [
-            {
-                'match_id': match_id,
-                'player_id': player_id,
-                'time_step': t,
-                'pos_x': pos[0],
-                'pos_y': pos[1],
-                'pos_z': pos[2],
-                'life': life
-            }
-            for t in pos_attr.GetTimeSamples()
-            if (pos := pos_attr.Get(t)) is not None and (life := life_attr.Get(t)) is not None
-        ]
+            return None
+
+        # AttributeQuery caches value resolution, so each Get skips the full lookup
+        pos_query = Usd.AttributeQuery(pos_attr)
+        life_query = Usd.AttributeQuery(life_attr)
+        times = pos_attr.GetTimeSamples()
+        positions = [pos_query.Get(t) for t in times]
+        lives = [life_query.Get(t) for t in times]
+
+        keep = [i for i, (pos, life) in enumerate(zip(positions, lives)) if pos is not None and life is not None]
+        pos_arr = np.array([positions[i] for i in keep], dtype=np.float32).reshape(-1, 3)
+
+        # Columns in BREADCRUMB_SCHEMA order
+        return (
+            np.full(len(keep), match_id, dtype=np.int32),
+            np.full(len(keep), player_id, dtype=np.int32),
+            np.asarray(times, dtype=np.float32)[keep],
+            pos_arr[:, 0],
+            pos_arr[:, 1],
+            pos_arr[:, 2],
+            np.array([lives[i] for i in keep], dtype=np.int8)
+        )
     except Exception as e:
         print(f"⚠️ Failed to process {path}. Error: {e}")
-        return []
+        return None
 
-def save_chunk(chunk, header_written):
-    df = pd.DataFrame(chunk)
-    df.to_csv(OUTPUT_CSV, mode='a', index=False, header=not header_written)
-    return len(df)
+def save_chunk(chunk, writer):
+    columns = [np.concatenate(col) for col in zip(*chunk)]
+    table = pa.Table.from_arrays(columns, schema=BREADCRUMB_SCHEMA)
+    writer.write_table(table)
+    return table.num_rows
 
 # === Main Execution ===
 
@@ -101,25 +124,31 @@ def main():
     player_paths = find_player_paths(stage)
 
     all_data_chunk = []
-    header_written = False
 
     print(f"--- Step 3: Extracting data in chunks of {CHUNK_SIZE} ---")
-    for i, path in enumerate(player_paths):
-        print(f"-> Processing player {i+1}/{len(player_paths)}: {path}")
-        data = extract_player_data(stage, path)
-        all_data_chunk.extend(data)
-
-        if (i + 1) % CHUNK_SIZE == 0 or (i + 1) == len(player_paths):
-            if not all_data_chunk:
-                print("  - No data to save in this chunk.")
-                continue
-            print(f"  --> Saving chunk at player {i+1} with {len(all_data_chunk)} rows...")
-            rows_written = save_chunk(all_data_chunk, header_written)
-            print(f"✅ {rows_written} rows written.")
-            header_written = True
-            all_data_chunk = []
-
-    print(f"\n🎉 SUCCESS! Data saved to: {OUTPUT_CSV}")
+    with pa.output_stream(OUTPUT_PARQUET, buffer_size=WRITE_BUFFER_SIZE) as sink, \
+            ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        writer = pq.ParquetWriter(sink, BREADCRUMB_SCHEMA, compression='zstd')
+        try:
+            # Stage reads are thread-safe; map keeps results in player order
+            results = executor.map(lambda path: extract_player_data(stage, path), player_paths)
+            for i, (path, data) in enumerate(zip(player_paths, results)):
+                print(f"-> Processed player {i+1}/{len(player_paths)}: {path}")
+                if data is not None:
+                    all_data_chunk.append(data)
+
+                if (i + 1) % CHUNK_SIZE == 0 or (i + 1) == len(player_paths):
+                    if not all_data_chunk:
+                        print("  - No data to save in this chunk.")
+                        continue
+                    print(f"  --> Saving chunk at player {i+1} with {sum(len(data[0]) for data in all_data_chunk)} rows...")
+                    rows_written = save_chunk(all_data_chunk, writer)
+                    print(f"✅ {rows_written} rows written.")
+                    all_data_chunk = []
+        finally:
+            writer.close()
+
+    print(f"\n🎉 SUCCESS! Data saved to: {OUTPUT_PARQUET}")
 
 if __name__ == "__main__":
     main()